@@ -1,12 +1,11 @@
-from requests import HTTPError
-from pprint import pprint
-import subprocess
-import requests
-import secrets
+import threading
+import importlib
+import functools
 import base64
+from datetime import date
 import json
 import time
-import bs4
+import sys
 import os
 import re
 
@@ -17,12 +16,46 @@ APIKEY = os.getenv("M4D-KONTUR-APIKEY")
 EXTERN_TOKEN = None
 EXTERN_REFRESH_TOKEN = None
 EXTERN_TOKEN_TIME = 0  # Пока не используется
+organization_id = None
 
 
 class CustomError(Exception):
     """Класс для описания ошибок"""
 
 
+class _LazyModule:
+    """Модуль, импортируемый при первом обращении к его атрибутам"""
+    # Тяжелые зависимости (requests, bs4 + lxml) не нужны для большинства
+    # команд CLI и заметно замедляют холодный старт
+
+    def __init__(self, name, path=None):
+        self._name = name
+        self._path = path
+        self._module = None
+
+    def _load(self):
+        if self._module is None:
+            if self._path is None:
+                self._module = importlib.import_module(self._name)
+            else:
+                from importlib.util import spec_from_file_location, module_from_spec
+
+                if not os.path.exists(self._path):
+                    raise CustomError(f"Не найден файл {self._path}")
+                spec = spec_from_file_location(self._name, self._path)
+                self._module = module_from_spec(spec)
+                spec.loader.exec_module(self._module)
+        return self._module
+
+    def __getattr__(self, attr):
+        return getattr(self._load(), attr)
+
+
+requests = _LazyModule("requests")
+# Локальный secrets.py грузится по пути, чтобы не затенять стандартный модуль secrets
+credentials = _LazyModule("credentials", os.path.join(os.path.dirname(os.path.abspath(__file__)), "secrets.py"))
+
+
 def change_environment():
     """Изменение окружения"""
 
@@ -32,8 +65,8 @@ def change_environment():
 
     if ENV:
         URL = "https://m4d-api.kontur.ru" 
-        APIKEY = secrets.APIKEY
-        organization_id = secrets.organization_id
+        APIKEY = credentials.APIKEY
+        organization_id = credentials.organization_id
         print("Production environment using")
     else:
         URL = "https://m4d-api-staging.testkontur.ru"
@@ -64,7 +97,7 @@ def get_extern_account_id():
     req = requests.get("https://extern-api.testkontur.ru/v1",
                        headers={"Authorization": f"Bearer {EXTERN_TOKEN}"})
     if req.status_code != 200:
-        raise HTTPError(f"Unsuccessful HTTP request /v1.\n{req.text}")
+        raise requests.HTTPError(f"Unsuccessful HTTP request /v1.\n{req.text}")
     return req.json()["accounts"][0]["id"]
 
 
@@ -83,11 +116,11 @@ def get_extern_token():
 
     identity_url = "https://identity.testkontur.ru"
     req = requests.post(f"{identity_url}/connect/deviceauthorization",
-                        data={"client_id": secrets.client_id,
-                              "client_secret": secrets.client_secret,
+                        data={"client_id": credentials.client_id,
+                              "client_secret": credentials.client_secret,
                               "scope": "extern.api offline_access"})
     if req.status_code != 200:
-        raise HTTPError(f"{req.text}")
+        raise requests.HTTPError(f"{req.text}")
     auth_data = req.json()
 
     open_new_tab(auth_data['verification_uri_complete'])
@@ -95,8 +128,8 @@ def get_extern_token():
 
     while True:
         req = requests.post(f"{identity_url}/connect/token",
-                            data={"client_id": secrets.client_id,
-                                  "client_secret": secrets.client_secret,
+                            data={"client_id": credentials.client_id,
+                                  "client_secret": credentials.client_secret,
                                   "device_code": f"{device_code}",
                                   "grant_type": "urn:ietf:params:oauth:grant-type:device_code",
                                   "scope": "extern.api offline_access"})
@@ -105,7 +138,7 @@ def get_extern_token():
                 print("authorization_pending")
                 time.sleep(3)
             else:
-                raise HTTPError(f"{req.text}")
+                raise requests.HTTPError(f"{req.text}")
         else:
             EXTERN_TOKEN = req.json()["access_token"]
             EXTERN_REFRESH_TOKEN = req.json()["refresh_token"]
@@ -119,13 +152,13 @@ def refresh_extern_token():
 
     identity_url = "https://identity.testkontur.ru"
     req = requests.post(f"{identity_url}/connect/token",
-                        data={"client_id": secrets.client_id,
-                              "client_secret": secrets.client_secret,
+                        data={"client_id": credentials.client_id,
+                              "client_secret": credentials.client_secret,
                               "scope": "extern.api offline_access",
                               "grant_type": "refresh_token",
                               "refresh_token": EXTERN_REFRESH_TOKEN})
     if req.status_code != 200:
-        raise HTTPError(f"{req.text}")
+        raise requests.HTTPError(f"{req.text}")
     else:
         EXTERN_TOKEN = req.json()["access_token"]
         EXTERN_REFRESH_TOKEN = req.json()["refresh_token"]
@@ -138,31 +171,375 @@ def sign_file(filepath, rawsign=False):
     # Для DetachesCMS подписи отпечаток сертификата
     # Для RAW подписи FQCN имя контейнера
 
+    import subprocess
+
     if rawsign:
         # Нужна утилита csptest
         if not os.path.exists("./csptest.exe"):
             raise CustomError("Не найдена утилита csptest")
-        command = f'csptest -keys -sign GOST12_256 -cont "\{secrets.container_name}" -keytype exchange -in {filepath} -out {filepath}.sig'
+        command = f'csptest -keys -sign GOST12_256 -cont "\{credentials.container_name}" -keytype exchange -in {filepath} -out {filepath}.sig'
     else:
         # Нужна утилита cryptcp
         if not os.path.exists("./cryptcp.x64.exe"):
             raise CustomError("Не найдена утилита cryptcp")
-        command = f'cryptcp.x64.exe -sign -thumbprint {secrets.certificate_thumbprint} {filepath} -der -strict -detached -fext .sig'
+        command = f'cryptcp.x64.exe -sign -thumbprint {credentials.certificate_thumbprint} {filepath} -der -strict -detached -fext .sig'
     subprocess.call(command, shell=True)
 
 
+####
+# Типизированные результаты
+####
+
+
+def _lookup(data, *path):
+    """Получение вложенного значения из JSON без KeyError"""
+
+    for key in path:
+        if not isinstance(data, dict):
+            return None
+        data = data.get(key)
+    return data
+
+
+def _unmapped(data, mapped):
+    """Ключи JSON, не разобранные в поля записи, или None"""
+
+    return {key: value for key, value in data.items() if key not in mapped} or None
+
+
+def _to_json(value):
+    """Преобразование записи обратно в JSON-совместимые структуры"""
+
+    if isinstance(value, _Record):
+        return value.to_dict()
+    if isinstance(value, (tuple, list)):
+        return [_to_json(item) for item in value]
+    return value
+
+
+class _Record:
+    """Базовый класс компактных записей"""
+    # __slots__ вместо dict экономит память на сотнях тысяч МЧД из поиска.
+    # Вложенные секции хранятся сырыми и разбираются при первом обращении
+
+    __slots__ = ()
+    _public_fields = ()
+
+    def to_dict(self):
+        return {name: _to_json(getattr(self, name)) for name in self._public_fields}
+
+    def __repr__(self):
+        fields = ", ".join(f"{name}={getattr(self, name)!r}" for name in self._public_fields)
+        return f"{type(self).__name__}({fields})"
+
+
+class ApiError(_Record):
+    """Ошибка из ответа API"""
+
+    __slots__ = ("code", "message", "values")
+    _public_fields = __slots__
+
+    def __init__(self, code, message, values=()):
+        self.code = code
+        self.message = message
+        self.values = values
+
+    @classmethod
+    def from_json(cls, data):
+        message = data.get("message") or ""
+        # Значения, на которые ссылается ошибка, API отдает только в тексте сообщения в кавычках
+        return cls(data.get("code"), message, tuple(re.findall("'(.*?)'", message)))
+
+    def _inn(self, index):
+        if self.code != "representativeInnDoesNotMatch" or len(self.values) <= index:
+            return None
+        value = self.values[index]
+        return value if value.isdigit() else None
+
+    @property
+    def expected_inn(self):
+        """Переданный ИНН представителя из ошибки representativeInnDoesNotMatch или None"""
+
+        return self._inn(0)
+
+    @property
+    def actual_inn(self):
+        """ИНН представителя в МЧД из ошибки representativeInnDoesNotMatch или None"""
+
+        return self._inn(1)
+
+
+class Representative(_Record):
+    """Реквизиты представителя"""
+
+    __slots__ = ("inn", "snils", "name", "surname", "middlename", "extra")
+    _public_fields = __slots__
+    _mapped_keys = ("inn", "snils", "name", "surname", "middlename")
+
+    def __init__(self, inn=None, snils=None, name=None, surname=None, middlename=None, extra=None):
+        self.inn = inn
+        self.snils = snils
+        self.name = name
+        self.surname = surname
+        self.middlename = middlename
+        self.extra = extra
+
+    @classmethod
+    def from_json(cls, data):
+        return cls(*(data.get(field) for field in cls._mapped_keys), extra=_unmapped(data, cls._mapped_keys))
+
+
+class PoaMeta(_Record):
+    """Метаинформация об МЧД"""
+
+    __slots__ = ("number", "poa_type", "status", "principal_inn", "start_date", "end_date", "_packed")
+    _public_fields = ("number", "poa_type", "status", "principal_inn", "start_date", "end_date", "principal",
+                      "representatives", "extra")
+    _mapped_keys = {"poa", "number", "poaType", "status", "principal", "principalInn", "startDate", "endDate",
+                    "representatives"}
+
+    @classmethod
+    def from_json(cls, data):
+        # Метаинформация по номеру обернута в "poa", элементы поиска - нет
+        poa = data.get("poa") or data
+        record = cls.__new__(cls)
+        record.number = poa.get("number")
+        record.poa_type = poa.get("poaType")
+        record.status = data.get("status") or poa.get("status")
+        record.principal_inn = _lookup(poa, "principal", "inn") or poa.get("principalInn")
+        record.start_date = poa.get("startDate")
+        record.end_date = poa.get("endDate")
+        # Доверитель, представители и прочие ключи ответа нужны редко, поэтому хранятся
+        # одной компактной JSON-строкой и разбираются при каждом обращении
+        extra = _unmapped(poa, cls._mapped_keys) or {}
+        if poa is not data:
+            extra.update(_unmapped(data, cls._mapped_keys) or {})
+        packed = {key: value for key, value in (("principal", poa.get("principal")),
+                                                ("representatives", poa.get("representatives")),
+                                                ("extra", extra)) if value}
+        record._packed = json.dumps(packed, ensure_ascii=False, separators=(",", ":")).encode() if packed else None
+        return record
+
+    def _unpack(self, key):
+        return json.loads(self._packed).get(key) if self._packed else None
+
+    @property
+    def principal(self):
+        return self._unpack("principal")
+
+    @property
+    def representatives(self):
+        return tuple(Representative.from_json(item) for item in self._unpack("representatives") or ())
+
+    @property
+    def extra(self):
+        return self._unpack("extra")
+
+
+class PoaSearchPage(_Record):
+    """Страница результатов поиска МЧД"""
+
+    __slots__ = ("total_count", "next_token", "_items")
+    _public_fields = ("total_count", "next_token", "items")
+
+    @classmethod
+    def from_json(cls, data):
+        # Форма ответа как у /organizations: {"totalCount": ..., "poas": {"items": [...]}}
+        record = cls.__new__(cls)
+        record.total_count = data.get("totalCount")
+        record.next_token = data.get("nextToken")
+        record._items = _lookup(data, "poas", "items") or []
+        return record
+
+    @property
+    def items(self):
+        if isinstance(self._items, list):
+            self._items = tuple(PoaMeta.from_json(item) for item in self._items)
+        return self._items
+
+
+class ValidationResult(_Record):
+    """Результат валидации МЧД"""
+
+    __slots__ = ("_errors",)
+    _public_fields = ("is_valid", "errors")
+
+    @classmethod
+    def from_json(cls, data):
+        """Разбор секции result операции валидации"""
+
+        record = cls.__new__(cls)
+        record._errors = data.get("errors") or []
+        return record
+
+    @property
+    def errors(self):
+        if isinstance(self._errors, list):
+            self._errors = tuple(ApiError.from_json(error) for error in self._errors)
+        return self._errors
+
+    @property
+    def is_valid(self):
+        return not self.errors
+
+    def find_error(self, code):
+        """Первая ошибка с указанным кодом или None"""
+
+        for error in self.errors:
+            if error.code == code:
+                return error
+
+
+class OperationStatus(_Record):
+    """Статус асинхронной операции"""
+
+    __slots__ = ("id", "status", "operation_type", "_result", "extra")
+    _public_fields = ("id", "status", "result", "extra")
+    _mapped_keys = {"id", "status", "result"}
+
+    @classmethod
+    def from_json(cls, data, operation_type=None):
+        record = cls.__new__(cls)
+        record.id = data.get("id")
+        record.status = data.get("status")
+        record.operation_type = operation_type
+        record._result = data.get("result")
+        # В том числе описание ошибки операции со статусом error
+        record.extra = _unmapped(data, cls._mapped_keys)
+        return record
+
+    @property
+    def is_terminal(self):
+        return self.status in ("done", "error")
+
+    @property
+    def result(self):
+        if self.operation_type == "validations" and isinstance(self._result, dict):
+            self._result = ValidationResult.from_json(self._result)
+        return self._result
+
+
+####
+# Объединение одинаковых запросов
+####
+
+
+class _SingleFlight:
+    """Одновременные одинаковые вызовы разделяют один HTTP запрос и его результат"""
+
+    class _Call:
+        __slots__ = ("event", "result", "error", "completed")
+
+        def __init__(self):
+            self.event = threading.Event()
+            self.result = None
+            self.error = None
+            self.completed = False
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+        self._tasks = {}
+
+    def do(self, key, func, *args, **kwargs):
+        """Вызов в потоке: ведомые потоки ждут результат первого"""
+
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = self._Call()
+        if not leader:
+            call.event.wait()
+            if not call.completed:
+                # Первый вызов прерван (KeyboardInterrupt, SystemExit) - это не ошибка запроса
+                return self.do(key, func, *args, **kwargs)
+            if call.error is not None:
+                # Свое исключение каждому ожидающему, чтобы traceback не смешивался между потоками
+                import copy
+
+                try:
+                    error = copy.copy(call.error)
+                except Exception:
+                    error = CustomError(str(call.error))
+                raise error from call.error
+            return call.result
+        try:
+            call.result = func(*args, **kwargs)
+            call.completed = True
+            return call.result
+        except Exception as error:
+            call.error = error
+            call.completed = True
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.event.set()
+
+    async def do_async(self, key, func, *args, **kwargs):
+        """Вызов из asyncio: запрос уходит в executor, корутины ждут общий future"""
+        # Через do() объединяются и с одновременными вызовами из потоков
+
+        import asyncio
+
+        loop = asyncio.get_running_loop()
+        task_key = (loop, key)
+        task = self._tasks.get(task_key)
+        if task is None:
+            task = loop.run_in_executor(None, functools.partial(self.do, key, func, *args, **kwargs))
+            self._tasks[task_key] = task
+            task.add_done_callback(lambda _: self._tasks.pop(task_key, None))
+        # shield, чтобы отмена одного ожидающего не отменяла запрос для остальных
+        return await asyncio.shield(task)
+
+
+_SINGLE_FLIGHT = _SingleFlight()
+
+
+def _single_flight(func):
+    """Объединение одновременных одинаковых вызовов функции чтения"""
+    # Результат общий для всех ожидающих, изменять его нельзя.
+    # Для asyncio: await get_poa_metainfo.aio(poa_number)
+
+    signature = None
+
+    def key(args, kwargs):
+        # Аргументы приводятся к именованным со значениями по умолчанию,
+        # чтобы f(x) и f(x, default) или f(x, name=...) давали один ключ
+        nonlocal signature
+        if signature is None:
+            import inspect
+
+            signature = inspect.signature(func)
+        bound = signature.bind(*args, **kwargs)
+        bound.apply_defaults()
+        return func.__name__, URL, organization_id, tuple(bound.arguments.items())
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        return _SINGLE_FLIGHT.do(key(args, kwargs), func, *args, **kwargs)
+
+    async def aio(*args, **kwargs):
+        return await _SINGLE_FLIGHT.do_async(key(args, kwargs), func, *args, **kwargs)
+
+    wrapper.aio = aio
+    return wrapper
+
+
 ####
 # Работа с организациями
 ####
 
 
+@_single_flight
 def get_organizations():
     """Список доступных организаций"""
 
     organizations_req = requests.get(f"{URL}/v1/organizations",
                                      headers={"X-Kontur-Apikey": APIKEY})
     if organizations_req.status_code != 200:
-        raise HTTPError(f"Unsuccessful HTTP request /organizations. {organizations_req.text}")
+        raise requests.HTTPError(f"Unsuccessful HTTP request /organizations. {organizations_req.text}")
     if organizations_req.json()["totalCount"] == 0:
         raise CustomError("No organizations available. Please follow the instruction https://clck.ru/35aL5Z")
     return organizations_req.json()
@@ -187,6 +564,7 @@ def get_organization_info(org_id):
             return organization
 
 
+@_single_flight
 def get_operation_status(operation_id, operation_type="r"):
     """Получение данных об операции"""
 
@@ -194,8 +572,8 @@ def get_operation_status(operation_id, operation_type="r"):
     req = requests.get(f"{URL}/v1/organizations/{organization_id}/operations/{operations[operation_type]}/{operation_id}",
                        headers={"X-Kontur-Apikey": APIKEY})
     if req.status_code != 200:
-        raise HTTPError(f"Unsuccessful HTTP request.\n{req.text}")
-    return req.json()
+        raise requests.HTTPError(f"Unsuccessful HTTP request.\n{req.text}")
+    return OperationStatus.from_json(req.json(), operations[operation_type])
 
 
 ####
@@ -203,17 +581,22 @@ def get_operation_status(operation_id, operation_type="r"):
 ####
 
 
-def search_poas(sync_timeout_ms=1000, next_token=None, **params):
+def search_poas(sync_timeout_ms=1000, next_token=None, org_id=None, **params):
     """Поиск МЧД. Возможные параметры описаны в документации https://clck.ru/35aL42"""
+    # org_id - организация для поиска, по умолчанию текущая organization_id
 
-    req = requests.get(f"{URL}/v1/organizations/{organization_id}/poas",
+    params["sync_timeout_ms"] = sync_timeout_ms
+    if next_token:
+        params["next_token"] = next_token
+    req = requests.get(f"{URL}/v1/organizations/{org_id or organization_id}/poas",
                        headers={"X-Kontur-Apikey": APIKEY},
                        params={to_camel_case_converter(key): value for key, value in params.items()})
     if req.status_code != 200:
-        raise HTTPError(f"Unsuccessful HTTP request /poas.\n{req.text}")
-    return req
+        raise requests.HTTPError(f"Unsuccessful HTTP request /poas.\n{req.text}")
+    return PoaSearchPage.from_json(req.json())
 
 
+@_single_flight
 def get_poa_metainfo(poa_number, sync_timeout_ms=1000):
     """Получение метаинформации об МЧД"""
 
@@ -221,8 +604,8 @@ def get_poa_metainfo(poa_number, sync_timeout_ms=1000):
                        headers={"X-KONTUR-APIKEY": APIKEY},
                        params={"SyncTimeoutMs": sync_timeout_ms})
     if req.status_code != 200:
-        raise HTTPError(f"Unsuccessful HTTP request /poas/poa_number.\n{req.text}")
-    return req.json()
+        raise requests.HTTPError(f"Unsuccessful HTTP request /poas/poa_number.\n{req.text}")
+    return PoaMeta.from_json(req.json())
 
 
 def get_archive(poa_number):
@@ -232,7 +615,7 @@ def get_archive(poa_number):
         req = requests.get(f"{URL}/v1/organizations/{organization_id}/poas/{poa_number}/zip-archive",
                            headers={"X-KONTUR-APIKEY": APIKEY})
         if req.status_code != 200:
-            raise HTTPError(f"Unsuccessful HTTP request /zip-archive.\n{req.text}")
+            raise requests.HTTPError(f"Unsuccessful HTTP request /zip-archive.\n{req.text}")
         archive.write(req.content)
 
 
@@ -248,9 +631,9 @@ def get_revocation_xml_file(poa_number, reason=None):
                               "ogrn": organization_info["ogrn"],
                               "kpp": organization_info["kpp"],
                               "name": organization_info['fullName'],
-                              "poaType": poa_info["poa"]['poaType']})
+                              "poaType": poa_info.poa_type})
     if req.status_code != 200:
-        raise HTTPError(f"Unsuccessful HTTP request /revocation/form-xml.\n{req.text}")
+        raise requests.HTTPError(f"Unsuccessful HTTP request /revocation/form-xml.\n{req.text}")
     with open(f"./revocation_poa_{poa_number}.xml", "wb") as xml:
         xml.write(req.content)
 
@@ -313,8 +696,8 @@ def validation_poa(principal: dict, poa_identity={}, representative={},
                         headers={"X-KONTUR-APIKEY": APIKEY},
                         json=payload)
     if req.status_code != 200:
-        raise HTTPError(f"Unsuccessful HTTP request /validate-local.\n{req.text}")
-    return req.json()
+        raise requests.HTTPError(f"Unsuccessful HTTP request /validate-local.\n{req.text}")
+    return OperationStatus.from_json(req.json(), "validations")
 
 
 def create_xml_from_json(json_data, filename="poa"):
@@ -324,7 +707,7 @@ def create_xml_from_json(json_data, filename="poa"):
                         headers={"X-KONTUR-APIKEY": APIKEY},
                         json=json_data)
     if req.status_code != 200:
-        raise HTTPError(f"Unsuccessful HTTP request /form-xml.\n{req.text}")
+        raise requests.HTTPError(f"Unsuccessful HTTP request /form-xml.\n{req.text}")
     with open(f"./{filename}.xml", "wb") as poa:
         poa.write(req.content)
 
@@ -345,7 +728,7 @@ def create_draft_from_xml_file(path_to_file, send_to_sign=False):
                             data={"sendToSign": send_to_sign},
                             files={"poa": xml.read()})
     if req.status_code != 200:
-        raise HTTPError(f"Unsuccessful HTTP request /drafts.\n{req.text}")
+        raise requests.HTTPError(f"Unsuccessful HTTP request /drafts.\n{req.text}")
     return req.json()["draftId"]
 
 
@@ -356,7 +739,7 @@ def download_poa_draft(poa_number):
         req = requests.get(f"{URL}/v1/organizations/{organization_id}/drafts/{poa_number}/xml",
                            headers={"X-KONTUR-APIKEY": APIKEY})
         if req.status_code != 200:
-            raise HTTPError(f"Unsuccessful HTTP request /poa_number/xml.\n{req.text}")
+            raise requests.HTTPError(f"Unsuccessful HTTP request /poa_number/xml.\n{req.text}")
         poa.write(req.content)
 
 
@@ -373,7 +756,7 @@ def async_registration(poa_path, signature_path, polling_time_sec=1):
                             headers={"X-Kontur-Apikey": APIKEY},
                             files={"poa": poa.read(), "signature": sig.read()})
         if req.status_code != 201:
-            raise HTTPError(f"Unsuccessful HTTP request /registrations.\n{req.text}")
+            raise requests.HTTPError(f"Unsuccessful HTTP request /registrations.\n{req.text}")
     print(req.json())
     operation_id = req.json()["id"]
 
@@ -381,9 +764,9 @@ def async_registration(poa_path, signature_path, polling_time_sec=1):
         req = requests.get(f"{URL}/v1/organizations/{organization_id}/operations/registrations/{operation_id}",
                            headers={"X-Kontur-Apikey": APIKEY})
         if req.status_code != 200:
-            raise HTTPError(f"Unsuccessful HTTP request /registrations/operation_id.\n{req.text}")
+            raise requests.HTTPError(f"Unsuccessful HTTP request /registrations/operation_id.\n{req.text}")
         if req.json()['status'] in ("done", "error"):
-            return req.json()
+            return OperationStatus.from_json(req.json(), "registrations")
         time.sleep(polling_time_sec)
 
 
@@ -396,8 +779,8 @@ def async_download(number, principal_inn, inn, datatype="archive", polling_time_
         req = requests.get(f"{URL}/v1/organizations/{organization_id}/operations/downloads/{operation_id}/meta",
                            headers={"X-Kontur-Apikey": APIKEY})
         if req.status_code != 200:
-            raise HTTPError(f"Unsuccessful HTTP request /meta.\n{req.text}")
-        return req.json()
+            raise requests.HTTPError(f"Unsuccessful HTTP request /meta.\n{req.text}")
+        return PoaMeta.from_json(req.json())
 
     def create_archive(operation_id):
         """Получение архива с файлами МЧД"""
@@ -405,7 +788,7 @@ def async_download(number, principal_inn, inn, datatype="archive", polling_time_
         req = requests.get(f"{URL}//v1/organizations/{organization_id}/operations/downloads/{operation_id}/zip-archive",
                            headers={"X-Kontur-Apikey": APIKEY})
         if req.status_code != 200:
-            raise HTTPError(f"Unsuccessful HTTP request /zip-archive.\n{req.text}")
+            raise requests.HTTPError(f"Unsuccessful HTTP request /zip-archive.\n{req.text}")
         with open(f"poa_{number}.zip", "wb") as archive:
             archive.write(req.content)
 
@@ -425,7 +808,7 @@ def async_download(number, principal_inn, inn, datatype="archive", polling_time_
                         headers={"X-Kontur-Apikey": APIKEY},
                         json=payload)
     if req.status_code != 201:
-        raise HTTPError(f"Unsuccessful HTTP request /downloads.\n{req.text}")
+        raise requests.HTTPError(f"Unsuccessful HTTP request /downloads.\n{req.text}")
     print(req.json())
     operation_id = req.json()["id"]
 
@@ -433,14 +816,14 @@ def async_download(number, principal_inn, inn, datatype="archive", polling_time_
         req = requests.get(f"{URL}/v1/organizations/{organization_id}/operations/downloads/{operation_id}",
                            headers={"X-Kontur-Apikey": APIKEY})
         if req.status_code != 200:
-            raise HTTPError(f"Unsuccessful HTTP request /downloads/operation_id.\n{req.text}")
+            raise requests.HTTPError(f"Unsuccessful HTTP request /downloads/operation_id.\n{req.text}")
         if req.json()['status'] == "done":
             if datatype == "archive":
                 return create_archive(operation_id)
             else:
                 return return_meta(operation_id)
         elif req.json()['status'] == "error":
-            return req.json()
+            return OperationStatus.from_json(req.json(), "downloads")
         time.sleep(polling_time_sec)
 
 
@@ -463,7 +846,7 @@ def async_import(number, principal_inn, inn, polling_time_sec=1):
                         headers={"X-Kontur-Apikey": APIKEY},
                         json=payload)
     if req.status_code != 201:
-        raise HTTPError(f"Unsuccessful HTTP request /imports.\n{req.text}")
+        raise requests.HTTPError(f"Unsuccessful HTTP request /imports.\n{req.text}")
     print(req.json())
     operation_id = req.json()["id"]
 
@@ -471,9 +854,9 @@ def async_import(number, principal_inn, inn, polling_time_sec=1):
         req = requests.get(f"{URL}/v1/organizations/{organization_id}/operations/imports/{operation_id}",
                            headers={"X-Kontur-Apikey": APIKEY})
         if req.status_code != 200:
-            raise HTTPError(f"Unsuccessful HTTP request /imports/operation_id.\n{req.text}")
+            raise requests.HTTPError(f"Unsuccessful HTTP request /imports/operation_id.\n{req.text}")
         if req.json()['status'] in ("done", "error"):
-            return req.json()
+            return OperationStatus.from_json(req.json(), "imports")
         time.sleep(polling_time_sec)
 
 
@@ -485,7 +868,7 @@ def async_revocation(revocation_file_path, signature_path, polling_time_sec=1):
                             headers={"X-Kontur-Apikey": APIKEY},
                             files={"revocation": revocation.read(), "signature": sig.read()})
         if req.status_code != 201:
-            raise HTTPError(f"Unsuccessful HTTP request /revocations.\n{req.text}")
+            raise requests.HTTPError(f"Unsuccessful HTTP request /revocations.\n{req.text}")
     print(req.json())
     operation_id = req.json()["id"]
 
@@ -493,9 +876,9 @@ def async_revocation(revocation_file_path, signature_path, polling_time_sec=1):
         req = requests.get(f"{URL}/v1/organizations/{organization_id}/operations/revocations/{operation_id}",
                            headers={"X-Kontur-Apikey": APIKEY})
         if req.status_code != 200:
-            raise HTTPError(f"Unsuccessful HTTP request /revocations/operation_id.\n{req.text}")
+            raise requests.HTTPError(f"Unsuccessful HTTP request /revocations/operation_id.\n{req.text}")
         if req.json()['status'] in ("done", "error"):
-            return req.json()
+            return OperationStatus.from_json(req.json(), "revocations")
         time.sleep(polling_time_sec)
 
 
@@ -557,7 +940,7 @@ def async_validation(principal: dict, poa_identity={}, representative={},
                         headers={"X-Kontur-Apikey": APIKEY},
                         json=payload)
     if req.status_code != 201:
-        raise HTTPError(f"Unsuccessful HTTP request /validations.\n{req.text}")
+        raise requests.HTTPError(f"Unsuccessful HTTP request /validations.\n{req.text}")
     print(req.json())
     operation_id = req.json()["id"]
 
@@ -565,9 +948,9 @@ def async_validation(principal: dict, poa_identity={}, representative={},
         req = requests.get(f"{URL}/v1/organizations/{organization_id}/operations/validations/{operation_id}",
                            headers={"X-Kontur-Apikey": APIKEY})
         if req.status_code != 200:
-            raise HTTPError(f"Unsuccessful HTTP request /validations/operation_id.\n{req.text}")
+            raise requests.HTTPError(f"Unsuccessful HTTP request /validations/operation_id.\n{req.text}")
         if req.json()['status'] in ("done", "error"):
-            return req.json()
+            return OperationStatus.from_json(req.json(), "validations")
         time.sleep(polling_time_sec)
 
 
@@ -583,7 +966,7 @@ def async_registration_fns_poa(poa_path, signature_path, certificate_path, fns_c
          "payerSnils": "17097865012",
          "senderInn": organization["inn"],
          "senderKpp": organization["kpp"],
-         "externAccountId": secrets.extern_account_id,
+         "externAccountId": credentials.extern_account_id,
          "senderCertificateContent": base64_encoder(certificate_path, True),
          "senderIpAddress": requests.get("https://api.ipify.org").text
          }
@@ -595,7 +978,7 @@ def async_registration_fns_poa(poa_path, signature_path, certificate_path, fns_c
                             files={"poa": poa.read(),
                                    "signature": sig.read()})
     if req.status_code != 201:
-        raise HTTPError(f"Unsuccessful HTTP request /fns/registrations.\n{req.text}")
+        raise requests.HTTPError(f"Unsuccessful HTTP request /fns/registrations.\n{req.text}")
     print(req.json())
     operation_id = req.json()["id"]
 
@@ -604,10 +987,10 @@ def async_registration_fns_poa(poa_path, signature_path, certificate_path, fns_c
                            headers={"X-Kontur-Apikey": APIKEY,
                                     "ExternOidcToken": EXTERN_TOKEN})
         if req.status_code != 200:
-            raise HTTPError(f"Unsuccessful HTTP request /fns/registrations/operation_id.\n{req.text}")
+            raise requests.HTTPError(f"Unsuccessful HTTP request /fns/registrations/operation_id.\n{req.text}")
         if req.json()['status'] in ("done", "error"):
             print(f"TraceId - {req.headers['X-Kontur-Trace-Id']}")
-            return req.json()
+            return OperationStatus.from_json(req.json(), "fns/registrations")
         time.sleep(polling_time_sec)
 
 
@@ -616,6 +999,8 @@ def async_registration_fss_poa(poa_path, signature_path, certificate_path,
                                polling_time_sec=1):
     """Регистрация МЧД для ФСС"""
 
+    from pprint import pprint
+
     organization = get_organization_info(organization_id)["legalEntity"]
     
     def registration_soap_message():
@@ -630,7 +1015,7 @@ def async_registration_fss_poa(poa_path, signature_path, certificate_path,
              # "payerSnils": "25193743483",
              "senderInn": organization["inn"],
              "senderKpp": organization["kpp"],
-             "externAccountId": secrets.extern_account_id,
+             "externAccountId": credentials.extern_account_id,
              "senderCertificateContent": base64_encoder(certificate_path, True),
              "senderIpAddress": requests.get("https://api.ipify.org").text
              }
@@ -642,7 +1027,7 @@ def async_registration_fss_poa(poa_path, signature_path, certificate_path,
                                 files={"poa": poa.read(),
                                        "signature": sig.read()})
         if req.status_code != 201:
-            raise HTTPError(f"Unsuccessful HTTP request /fss/soap-messages.\n{req.text}")
+            raise requests.HTTPError(f"Unsuccessful HTTP request /fss/soap-messages.\n{req.text}")
         print(f"TraceId CREATE SOAP MESSAGE - {req.headers['X-Kontur-Trace-Id']}")
         pprint(req.json())
         return req.json()["id"]
@@ -654,7 +1039,7 @@ def async_registration_fss_poa(poa_path, signature_path, certificate_path,
             req = requests.get(f"{URL}/v1/organizations/{organization_id}/operations/fss/soap-messages/{operation_id}",
                                headers={"X-Kontur-Apikey": APIKEY})
             if req.status_code != 200:
-                raise HTTPError(f"Unsuccessful HTTP request /soap-messages/operation_id.\n{req.text}")
+                raise requests.HTTPError(f"Unsuccessful HTTP request /soap-messages/operation_id.\n{req.text}")
             if req.json()['status'] == "error":
                 return req.json()
             elif req.json()['status'] == "done":
@@ -664,7 +1049,7 @@ def async_registration_fss_poa(poa_path, signature_path, certificate_path,
                                        headers={"X-Kontur-Apikey": APIKEY,
                                                 "ExternOidcToken": EXTERN_TOKEN})
                     if req.status_code != 200:
-                        raise HTTPError(f"Unsuccessful HTTP request /soap-messages/operation_id/content.\n{req.text}")
+                        raise requests.HTTPError(f"Unsuccessful HTTP request /soap-messages/operation_id/content.\n{req.text}")
                     soap.write(req.content)
                     return data
             time.sleep(polling_time_sec)
@@ -676,7 +1061,7 @@ def async_registration_fss_poa(poa_path, signature_path, certificate_path,
             raw_bytes = bytearray(raw_signature.read())
             raw_bytes.reverse()
         payload ={
-            "externAccountId": secrets.extern_account_id,
+            "externAccountId": credentials.extern_account_id,
             "draftId": draft_id,
             "documentId": document_id,
             "base64SoapMessageSignature": base64.b64encode(bytes(raw_bytes)).decode(),
@@ -687,7 +1072,7 @@ def async_registration_fss_poa(poa_path, signature_path, certificate_path,
                                      "ExternOidcToken": EXTERN_TOKEN},
                             json=payload)
         if req.status_code != 201:
-            raise HTTPError(f"Unsuccessful HTTP request /fss/registrations.\n{req.text}")
+            raise requests.HTTPError(f"Unsuccessful HTTP request /fss/registrations.\n{req.text}")
         print(f"TraceId REGISTRATION FSS POA - {req.headers['X-Kontur-Trace-Id']}")
         pprint(req.json())
         operation_id = req.json()["id"]
@@ -697,9 +1082,9 @@ def async_registration_fss_poa(poa_path, signature_path, certificate_path,
                                headers={"X-Kontur-Apikey": APIKEY,
                                         "ExternOidcToken": EXTERN_TOKEN})
             if req.status_code != 200:
-                raise HTTPError(f"Unsuccessful HTTP request /fss/registrations/operation_id.\n{req.text}")
+                raise requests.HTTPError(f"Unsuccessful HTTP request /fss/registrations/operation_id.\n{req.text}")
             if req.json()['status'] in ("done", "error"):
-                return req.json()
+                return OperationStatus.from_json(req.json(), "fss/registrations")
             time.sleep(polling_time_sec)
 
     soap_operation_id = registration_soap_message()
@@ -724,32 +1109,46 @@ def _get_poa(number, inn, datatype="archive"):
     requisites = async_validation({"inn": inn, "kpp": f"{inn[:4]}01001"},
                                   poa_identity={"number": number, "inn": inn},
                                   representative=representative)
-    key_mapping = {"representativeInnDoesNotMatch": "inn"}
+    error = requisites.result.find_error("representativeInnDoesNotMatch") if requisites.result else None
+    actual_inn = error.actual_inn if error else None
+    if actual_inn is None:
+        return f"Representative INN not found in validation result.\n{requisites=}"
+    return async_download(number, inn, actual_inn, datatype)
+
+
+def _public_get(url):
+    """Анонимный GET, возвращает (код ответа, тело)"""
+    # urllib вместо requests: импорт requests дороже всего запуска CLI,
+    # а статус проверяется по cron. Кассета подменяет эту функцию
+
+    from urllib.request import urlopen
+    from urllib.error import HTTPError
+
     try:
-        for error in requisites["result"]["errors"]:
-            if error['code'] == "representativeInnDoesNotMatch":
-                actual_inn = re.findall("'(.*?)'", error['message'])[1]
-                break
-        return async_download(number, inn, actual_inn, datatype)
-    except KeyError:
-        return f"KeyError has occured.\n{requisites=}"
+        with urlopen(url) as response:
+            return response.status, response.read()
+    except HTTPError as error:
+        return error.code, error.read()
 
 
 def _get_poa_status(number):
     """Запрос статуса МЧД по номеру"""
 
     if not ENV:
-        req = requests.get(f"https://m4d-cprr-it.gnivc.ru/api/v0/poar-portal/public/poa/{number}/public")
+        url = f"https://m4d-cprr-it.gnivc.ru/api/v0/poar-portal/public/poa/{number}/public"
     else:
-        req = requests.get(f"https://m4d.nalog.gov.ru/api/v0/poar-portal/public/poa/{number}/public")
-    if req.status_code != 200:
-        raise HTTPError(f"Unsuccessful HTTP request /poa/number/public.\n{req.text}")
-    return req.json()["status"]
+        url = f"https://m4d.nalog.gov.ru/api/v0/poar-portal/public/poa/{number}/public"
+    status_code, body = _public_get(url)
+    if status_code != 200:
+        raise CustomError(f"Unsuccessful HTTP request /poa/number/public.\n{body.decode(errors='replace')}")
+    return json.loads(body)["status"]
 
 
 def _validation_poa_files(poa_path, sign_path):
     """Валидация МЧД по файлам"""
 
+    import bs4
+
     with open(poa_path, "rb") as xml:
         content = bs4.BeautifulSoup(xml.read(), "xml")
     
@@ -762,9 +1161,520 @@ def _validation_poa_files(poa_path, sign_path):
                                             "surname": content.СведФизЛ.ФИО.attrs["Фамилия"],
                                             "middlename": content.СведФизЛ.ФИО.attrs["Отчество"]}
                             )
-    
+
+
+###
+# Запись и воспроизведение HTTP
+###
+
+
+class Cassette:
+    """Запись HTTP обменов в файл и их воспроизведение без сети"""
+    # Подменяет транспорт requests, поэтому работает для всех функций модуля.
+    # APIKEY и токены в кассету не попадают: заголовки запросов не сохраняются,
+    # а секреты в JSON ответах заменяются на REDACTED
+
+    REDACTED_KEYS = {"access_token", "refresh_token", "id_token", "device_code", "user_code",
+                     "client_secret", "verification_uri_complete"}
+    SKIPPED_HEADERS = {"set-cookie", "authorization"}
+
+    def __init__(self, path, mode="replay", latency=0.0):
+        if mode not in ("record", "replay"):
+            raise CustomError("Режим кассеты должен быть 'record' или 'replay'")
+        if latency != "recorded" and not (isinstance(latency, (int, float)) and 0 <= latency < float("inf")):
+            raise CustomError("Задержка кассеты должна быть 'recorded' или числом секунд >= 0")
+        self.path = path
+        self.mode = mode
+        # Задержка ответа при воспроизведении в секундах или "recorded" - как при записи
+        self.latency = latency
+        self._interactions = []
+        self._queues = {}
+        self._previous_requests = None
+        self._previous_public_get = None
+
+    def __enter__(self):
+        global requests, _public_get
+
+        if self.mode == "replay":
+            self.load()
+        self._previous_requests = requests
+        self._previous_public_get = _public_get
+        requests = _CassetteRequests(self)
+        _public_get = self._public_get
+        return self
+
+    def __exit__(self, *exc_info):
+        global requests, _public_get
+
+        requests = self._previous_requests
+        _public_get = self._previous_public_get
+        if self.mode == "record":
+            self.save()
+
+    def _public_get(self, url):
+        """Анонимный GET через транспорт кассеты"""
+
+        req = requests.get(url)
+        return req.status_code, req.content
+
+    def load(self):
+        import gzip
+        from collections import deque
+
+        with gzip.open(self.path, "rt", encoding="utf-8") as file:
+            self._interactions = json.load(file)["interactions"]
+        self._queues = {}
+        for interaction in self._interactions:
+            key = (interaction["method"], interaction["url"])
+            self._queues.setdefault(key, deque()).append(interaction)
+
+    def save(self):
+        import gzip
+
+        with gzip.open(self.path, "wt", encoding="utf-8") as file:
+            json.dump({"version": 1, "interactions": self._interactions}, file, ensure_ascii=False)
+
+    def _redact(self, data):
+        if isinstance(data, dict):
+            return {key: "REDACTED" if key in self.REDACTED_KEYS else self._redact(value)
+                    for key, value in data.items()}
+        if isinstance(data, list):
+            return [self._redact(item) for item in data]
+        return data
+
+    def record(self, request, response, elapsed):
+        """Сохранение обмена, ответ возвращается вызывающему без изменений"""
+
+        interaction = {"method": request.method,
+                       "url": request.url,
+                       "status": response.status_code,
+                       "reason": response.reason,
+                       "headers": {key: value for key, value in response.headers.items()
+                                   if key.lower() not in self.SKIPPED_HEADERS},
+                       "elapsed": elapsed}
+        content = response.content
+        try:
+            content = json.dumps(self._redact(json.loads(content)), ensure_ascii=False).encode()
+        except ValueError:
+            pass
+        try:
+            interaction["text"] = content.decode()
+        except UnicodeDecodeError:
+            interaction["base64"] = base64.b64encode(content).decode()
+        self._interactions.append(interaction)
+        return response
+
+    def play(self, request):
+        """Ответ из кассеты на запрос в порядке записи"""
+
+        from requests.models import Response
+        from requests.structures import CaseInsensitiveDict
+        from requests.utils import get_encoding_from_headers
+
+        queue = self._queues.get((request.method, request.url))
+        if not queue:
+            raise CustomError(f"В кассете {self.path} нет ответа на {request.method} {request.url}")
+        interaction = queue.popleft()
+        time.sleep(interaction["elapsed"] if self.latency == "recorded" else self.latency)
+
+        response = Response()
+        response.status_code = interaction["status"]
+        response.reason = interaction["reason"]
+        response.headers = CaseInsensitiveDict(interaction["headers"])
+        response.encoding = get_encoding_from_headers(response.headers)
+        response.url = request.url
+        response.request = request
+        if "text" in interaction:
+            response._content = interaction["text"].encode()
+        else:
+            response._content = base64.b64decode(interaction["base64"])
+        return response
+
+
+class _CassetteRequests(_LazyModule):
+    """Модуль requests, запросы которого идут через кассету"""
+
+    def __init__(self, cassette):
+        super().__init__("requests")
+        self._cassette = cassette
+        self._session = None
+
+    def _get_session(self):
+        if self._session is None:
+            from requests.adapters import HTTPAdapter
+            from http.cookiejar import DefaultCookiePolicy
+            from requests import Session
+
+            cassette = self._cassette
+
+            class CassetteAdapter(HTTPAdapter):
+                def send(self, request, **kwargs):
+                    if cassette.mode == "replay":
+                        return cassette.play(request)
+                    # Session выставляет response.elapsed только после send, поэтому время замеряется здесь
+                    start = time.perf_counter()
+                    response = super().send(request, **kwargs)
+                    return cassette.record(request, response, time.perf_counter() - start)
+
+            self._session = Session()
+            # Без cookies запросы совпадают с обычным запуском, где на каждый вызов новая сессия
+            self._session.cookies.set_policy(DefaultCookiePolicy(allowed_domains=[]))
+            self._session.mount("https://", CassetteAdapter())
+            self._session.mount("http://", CassetteAdapter())
+        return self._session
+
+    def request(self, method, url, **kwargs):
+        return self._get_session().request(method, url, **kwargs)
+
+    def get(self, url, **kwargs):
+        return self._get_session().get(url, **kwargs)
+
+    def options(self, url, **kwargs):
+        return self._get_session().options(url, **kwargs)
+
+    def head(self, url, **kwargs):
+        return self._get_session().head(url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self._get_session().post(url, **kwargs)
+
+    def put(self, url, **kwargs):
+        return self._get_session().put(url, **kwargs)
+
+    def patch(self, url, **kwargs):
+        return self._get_session().patch(url, **kwargs)
+
+    def delete(self, url, **kwargs):
+        return self._get_session().delete(url, **kwargs)
+
+
+###
+# Выгрузка для аналитики
+###
+
+
+EXPORT_SCHEMA = (("organization_id", "string"),
+                 ("number", "string"),
+                 ("principal_inn", "string"),
+                 ("representative_inn", "string"),
+                 ("representative_name", "string"),
+                 ("start_date", "date"),
+                 ("end_date", "date"),
+                 ("status", "string"))
+
+
+def iter_poas(org_id=None, **params):
+    """Все МЧД организации по страницам поиска"""
+
+    next_token = None
+    while True:
+        page = search_poas(next_token=next_token, org_id=org_id, **params)
+        yield from page.items
+        if not page.next_token or not page.items:
+            return
+        next_token = page.next_token
+
+
+def _parse_export_date(value):
+    """Дата из ISO строки, None для пустого или некорректного значения"""
+    # Дата не в ISO формате не должна прерывать длинную выгрузку
+
+    try:
+        return date.fromisoformat(value[:10]) if value else None
+    except (TypeError, ValueError):
+        return None
+
+
+def _export_row(poa, org_id):
+    """Строка выгрузки в порядке EXPORT_SCHEMA"""
+
+    representatives = poa.representatives
+    return (org_id,
+            poa.number,
+            poa.principal_inn,
+            ";".join(rep.inn or "" for rep in representatives) or None,
+            ";".join(" ".join(filter(None, (rep.surname, rep.name, rep.middlename)))
+                     for rep in representatives) or None,
+            _parse_export_date(poa.start_date),
+            _parse_export_date(poa.end_date),
+            poa.status)
+
+
+class _CsvExportWriter:
+    """Запись выгрузки в CSV, для *.gz со сжатием gzip"""
+
+    def __init__(self, path):
+        import csv
+        import gzip
+
+        if path.endswith(".gz"):
+            self._file = gzip.open(path, "wt", encoding="utf-8", newline="")
+        else:
+            self._file = open(path, "w", encoding="utf-8", newline="")
+        self._writer = csv.writer(self._file)
+        self._writer.writerow(name for name, _ in EXPORT_SCHEMA)
+
+    def write_batch(self, rows):
+        self._writer.writerows(rows)
+
+    def close(self):
+        self._file.close()
+
+
+class _ArrowExportWriter:
+    """Запись выгрузки в Parquet или Arrow IPC"""
+
+    def __init__(self, path, parquet):
+        try:
+            import pyarrow
+        except ImportError:
+            raise CustomError("Для выгрузки в Parquet/Arrow нужен пакет pyarrow")
+
+        self._pa = pyarrow
+        self._schema = pyarrow.schema([(name, pyarrow.string() if kind == "string" else pyarrow.date32())
+                                       for name, kind in EXPORT_SCHEMA])
+        if parquet:
+            import pyarrow.parquet
+
+            self._writer = pyarrow.parquet.ParquetWriter(path, self._schema, compression="zstd")
+        else:
+            self._writer = pyarrow.ipc.new_file(path, self._schema)
+
+    def write_batch(self, rows):
+        columns = zip(*rows)
+        batch = self._pa.record_batch([self._pa.array(column, type=field.type)
+                                       for column, field in zip(columns, self._schema)],
+                                      schema=self._schema)
+        self._writer.write_table(self._pa.Table.from_batches([batch]))
+
+    def close(self):
+        self._writer.close()
+
+
+def export_poas(path, organizations=None, batch_size=10000, **params):
+    """Выгрузка результатов поиска МЧД в Parquet, Arrow или CSV (.csv, .csv.gz)"""
+    # В памяти держится не больше одного пакета из batch_size строк
+
+    if path.endswith(".parquet"):
+        writer = _ArrowExportWriter(path, parquet=True)
+    elif path.endswith((".arrow", ".feather")):
+        writer = _ArrowExportWriter(path, parquet=False)
+    elif path.endswith((".csv", ".csv.gz")):
+        writer = _CsvExportWriter(path)
+    else:
+        raise CustomError("Поддерживаются форматы .parquet, .arrow, .feather, .csv и .csv.gz")
+
+    total = 0
+    rows = []
+    try:
+        for org_id in organizations or [organization_id]:
+            for poa in iter_poas(org_id=org_id, **params):
+                rows.append(_export_row(poa, org_id))
+                if len(rows) >= batch_size:
+                    writer.write_batch(rows)
+                    total += len(rows)
+                    rows = []
+        if rows:
+            writer.write_batch(rows)
+            total += len(rows)
+    except BaseException:
+        # Недописанный файл не должен выглядеть как готовая выгрузка
+        writer.close()
+        os.remove(path)
+        raise
+    writer.close()
+    return total
+
+
+###
+# Командная строка
+###
+
+
+_PROFILE_POA_NUMBER = "00000000-0000-0000-0000-000000000000"
+_PROFILE_STUB = """
+import io, sys, urllib.request
+# Сеть заглушена: замеряются только импорты, которые делает команда
+Response = type("Response", (io.BytesIO,), {"status": 200})
+urllib.request.urlopen = lambda *args, **kwargs: Response(b'{"status": "stub"}')
+from importlib.util import spec_from_file_location, module_from_spec
+spec = spec_from_file_location("m4d_api", sys.argv[1])
+module = module_from_spec(spec)
+spec.loader.exec_module(module)
+sys.exit(module.main(sys.argv[2:]))
+"""
+
+
+def profile_imports(argv, budget_ms=100, top=15, live=False):
+    """Отчет о времени импорта модулей при запуске команды CLI"""
+    # Запуск в отдельном процессе с -X importtime, чтобы замер был холодным.
+    # Без live запросы через urllib (команда status) не уходят в сеть
+
+    import subprocess
+
+    if live:
+        command = [sys.executable, "-X", "importtime", os.path.abspath(__file__), *argv]
+    else:
+        command = [sys.executable, "-X", "importtime", "-c", _PROFILE_STUB, os.path.abspath(__file__), *argv]
+    proc = subprocess.run(command, capture_output=True, text=True)
+    if proc.returncode != 0:
+        errors = [line for line in proc.stderr.splitlines() if not line.startswith("import time:")]
+        print("\n".join(errors[-10:]))
+        print(f"Command {' '.join(argv)} failed with exit code {proc.returncode}")
+        return False
+    modules = []
+    for line in proc.stderr.splitlines():
+        match = re.match(r"import time:\s+(\d+) \|\s+(\d+) \|( +)(\S+)", line)
+        if match:
+            self_us, cumulative_us, indent, name = match.groups()
+            modules.append((int(cumulative_us), int(self_us), len(indent) == 1, name))
+    total_ms = sum(cumulative for cumulative, _, top_level, _ in modules if top_level) / 1000
+    print(f"{'cumulative, ms':>15} {'self, ms':>10}  module")
+    for cumulative, self_us, _, name in sorted(modules, reverse=True)[:top]:
+        print(f"{cumulative / 1000:>15.1f} {self_us / 1000:>10.1f}  {name}")
+    print(f"Total import time: {total_ms:.1f} ms (budget {budget_ms} ms)")
+    return total_ms <= budget_ms
+
+
+def _print_json(data):
+    print(json.dumps(_to_json(data), ensure_ascii=False, indent=2))
+
+
+def _cassette_latency(value):
+    """Значение --cassette-latency: 'recorded' или число секунд >= 0"""
+
+    import argparse
+
+    if value == "recorded":
+        return value
+    try:
+        latency = float(value)
+    except ValueError:
+        latency = -1
+    if not 0 <= latency < float("inf"):
+        raise argparse.ArgumentTypeError(f"ожидается 'recorded' или число секунд >= 0, получено '{value}'")
+    return latency
+
+
+def _parse_params(params):
+    """Разбор параметров вида key=value"""
+
+    result = {}
+    for param in params:
+        key, sep, value = param.partition("=")
+        if not sep:
+            raise CustomError(f"Параметр '{param}' должен быть указан в виде key=value")
+        result[key] = value
+    return result
+
+
+def main(argv=None):
+    """Точка входа CLI"""
+
+    import argparse
+
+    parser = argparse.ArgumentParser(prog="m4d-api", description="Работа с МЧД через M4D API Контура")
+    parser.add_argument("--prod", action="store_true", help="использовать production окружение")
+    parser.add_argument("--org", type=int, default=2, help="порядковый номер организации (по умолчанию 2)")
+    parser.add_argument("--organization-id", help="Id организации, без запроса списка организаций")
+    parser.add_argument("--cassette", help="файл кассеты для записи или воспроизведения HTTP обменов")
+    parser.add_argument("--cassette-mode", choices=("record", "replay"), help="по умолчанию replay")
+    parser.add_argument("--cassette-latency", type=_cassette_latency,
+                        help="задержка ответов при воспроизведении в секундах или 'recorded'")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    search = subparsers.add_parser("search", help="поиск МЧД")
+    search.add_argument("params", nargs="*", metavar="key=value", help="параметры поиска в snake_case")
+
+    meta = subparsers.add_parser("meta", help="метаинформация об МЧД")
+    meta.add_argument("number")
+
+    archive = subparsers.add_parser("archive", help="архив с файлами МЧД")
+    archive.add_argument("number")
+
+    register = subparsers.add_parser("register", help="регистрация МЧД")
+    register.add_argument("poa_path")
+    register.add_argument("signature_path")
+    register.add_argument("--polling-time", type=float, default=1)
+
+    revoke = subparsers.add_parser("revoke", help="отзыв МЧД")
+    revoke.add_argument("revocation_path")
+    revoke.add_argument("signature_path")
+    revoke.add_argument("--polling-time", type=float, default=1)
+
+    validate = subparsers.add_parser("validate", help="валидация МЧД по файлам")
+    validate.add_argument("poa_path")
+    validate.add_argument("signature_path")
+
+    export = subparsers.add_parser("export", help="выгрузка результатов поиска в Parquet, Arrow или CSV")
+    export.add_argument("path", help="файл .parquet, .arrow, .feather, .csv или .csv.gz")
+    export.add_argument("params", nargs="*", metavar="key=value", help="параметры поиска в snake_case")
+    export.add_argument("--batch-size", type=int, default=10000)
+    export.add_argument("--all-orgs", action="store_true", help="выгрузить МЧД всех доступных организаций")
+
+    status = subparsers.add_parser("status", help="статус МЧД в реестре ФНС")
+    status.add_argument("number")
+
+    profile = subparsers.add_parser("profile-imports", help="отчет о времени импорта при запуске команды")
+    profile.add_argument("--budget-ms", type=float, default=100)
+    profile.add_argument("--top", type=int, default=15)
+    profile.add_argument("--live", action="store_true", help="не заглушать сеть в замеряемой команде")
+    profile.add_argument("args", nargs=argparse.REMAINDER,
+                         help=f"команда CLI для замера (по умолчанию status {_PROFILE_POA_NUMBER})")
+
+    args = parser.parse_args(argv)
+
+    if args.command == "profile-imports":
+        command = args.args[1:] if args.args[:1] == ["--"] else args.args
+        command = command or ["status", _PROFILE_POA_NUMBER]
+        return 0 if profile_imports(command, args.budget_ms, args.top, args.live) else 1
+
+    if not args.cassette and (args.cassette_mode is not None or args.cassette_latency is not None):
+        parser.error("--cassette-mode и --cassette-latency используются только вместе с --cassette")
+    if args.cassette:
+        latency = 0.0 if args.cassette_latency is None else args.cassette_latency
+        with Cassette(args.cassette, args.cassette_mode or "replay", latency):
+            return _run_command(args)
+    return _run_command(args)
+
+
+def _run_command(args):
+    """Выполнение команды CLI"""
+
+    global organization_id
+
+    if args.prod:
+        change_environment()
+    if args.command == "status":
+        print(_get_poa_status(args.number))
+        return 0
+
+    # Для выгрузки всех организаций выбирать одну не нужно
+    if not (args.command == "export" and args.all_orgs):
+        if args.organization_id:
+            organization_id = args.organization_id
+        elif organization_id is None:
+            organization_id = set_organization_id(args.org)
+
+    if args.command == "search":
+        _print_json(search_poas(**_parse_params(args.params)))
+    elif args.command == "meta":
+        _print_json(get_poa_metainfo(args.number))
+    elif args.command == "archive":
+        get_archive(args.number)
+    elif args.command == "register":
+        _print_json(async_registration(args.poa_path, args.signature_path, args.polling_time))
+    elif args.command == "revoke":
+        _print_json(async_revocation(args.revocation_path, args.signature_path, args.polling_time))
+    elif args.command == "validate":
+        _print_json(_validation_poa_files(args.poa_path, args.signature_path))
+    elif args.command == "export":
+        organizations = None
+        if args.all_orgs:
+            organizations = [org["id"] for org in get_organizations()["organizations"]["items"]]
+        print(f"Exported {export_poas(args.path, organizations, args.batch_size, **_parse_params(args.params))} POAs")
+    return 0
+
+
 if __name__ == "__main__":
-    organization_id = set_organization_id(2)
-    # poa_identity = {"number": "31cc6eee-b565-4266-9097-2a8ac00ff444", "inn": "4401165141"}
-    # principal = {"inn": "4401165141", "kpp": "440101001"}
-    # representative = {"name": "Иван", "surname": "Иванов", "snils": "252-639-136 73", "inn": "477704523710"}
+    sys.exit(main())
@@ -0,0 +1,176 @@
+"""Тесты объединения запросов и кассет против локального http.server"""
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from importlib.util import spec_from_file_location, module_from_spec
+import threading
+import asyncio
+import json
+import os
+import time
+
+import pytest
+
+requests = pytest.importorskip("requests")
+
+SCRIPT = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "m4d-api.py")
+
+
+@pytest.fixture
+def m4d():
+    spec = spec_from_file_location("m4d_api", SCRIPT)
+    module = module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+@pytest.fixture
+def server():
+    """Сервер M4D: отвечает {"id": ..., "status": ...}, считает запросы"""
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            with state["lock"]:
+                state["hits"].append(self.path)
+                count = len(state["hits"])
+            time.sleep(state["delay"])
+            status_code, body = state["respond"](self.path, count)
+            body = json.dumps(body).encode()
+            self.send_response(status_code)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    state = {"hits": [], "lock": threading.Lock(), "delay": 0.3,
+             "respond": lambda path, count: (200, {"id": "op", "status": "done"})}
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    state["url"] = f"http://127.0.0.1:{httpd.server_port}"
+    yield state
+    httpd.shutdown()
+    httpd.server_close()
+
+
+@pytest.fixture
+def api(m4d, server):
+    m4d.URL = server["url"]
+    m4d.APIKEY = "TEST-APIKEY"
+    m4d.organization_id = "org"
+    return m4d
+
+
+def run_threads(targets):
+    results = [None] * len(targets)
+
+    def run(index, target):
+        try:
+            results[index] = target()
+        except Exception as error:
+            results[index] = error
+
+    threads = [threading.Thread(target=run, args=(index, target)) for index, target in enumerate(targets)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+
+def test_threads_share_single_call(api, server):
+    results = run_threads([lambda: api.get_operation_status("op"),
+                           lambda: api.get_operation_status("op", "r"),
+                           lambda: api.get_operation_status("op", operation_type="r"),
+                           lambda: api.get_operation_status(operation_id="op")])
+
+    assert len(server["hits"]) == 1
+    assert all(result is results[0] for result in results)
+    assert results[0].status == "done"
+
+
+def test_threads_and_aio_share_single_call(api, server):
+    async def main():
+        return await asyncio.gather(api.get_operation_status.aio("op"),
+                                    api.get_operation_status.aio("op", "r"),
+                                    asyncio.to_thread(api.get_operation_status, "op"))
+
+    results = asyncio.run(main())
+
+    assert len(server["hits"]) == 1
+    assert all(result is results[0] for result in results)
+
+
+def test_waiters_get_own_exception_copy(api, server):
+    server["respond"] = lambda path, count: (500, {"message": "boom"})
+
+    errors = run_threads([lambda: api.get_operation_status("op")] * 3)
+
+    assert len(server["hits"]) == 1
+    assert all(isinstance(error, requests.HTTPError) for error in errors)
+    assert len({id(error) for error in errors}) == 3
+    leaders = [error for error in errors if error.__cause__ is None]
+    assert len(leaders) == 1
+    assert all(error.__cause__ is leaders[0] for error in errors if error is not leaders[0])
+
+
+def test_cancelled_waiter_leaves_call_running(api, server):
+    async def main():
+        first = asyncio.ensure_future(api.get_operation_status.aio("op"))
+        second = asyncio.ensure_future(api.get_operation_status.aio("op"))
+        await asyncio.sleep(0.1)
+        first.cancel()
+        return first, await second
+
+    first, result = asyncio.run(main())
+
+    assert first.cancelled()
+    assert result.status == "done"
+    assert len(server["hits"]) == 1
+
+
+def read_cassette(path):
+    import gzip
+
+    with gzip.open(path, "rt", encoding="utf-8") as file:
+        return file.read()
+
+
+def test_cassette_record_then_replay(api, server, tmp_path):
+    server["delay"] = 0.1
+    server["respond"] = lambda path, count: (200, {"id": "op",
+                                                   "status": "done" if count > 1 else "pending",
+                                                   "access_token": "SECRET-TOKEN"})
+    path = str(tmp_path / "cassette.json.gz")
+
+    with api.Cassette(path, "record"):
+        recorded = [api.get_operation_status("op").status, api.get_operation_status("op").status]
+        public = api._public_get(f"{server['url']}/public")
+
+    content = read_cassette(path)
+    assert recorded == ["pending", "done"]
+    assert "TEST-APIKEY" not in content
+    assert "SECRET-TOKEN" not in content
+    assert all(interaction["elapsed"] >= 0.1 for interaction in json.loads(content)["interactions"])
+
+    hits = len(server["hits"])
+    start = time.perf_counter()
+    with api.Cassette(path, "replay", "recorded"):
+        replayed = [api.get_operation_status("op").status, api.get_operation_status("op").status]
+        status_code, body = api._public_get(f"{server['url']}/public")
+        assert status_code == public[0]
+        assert json.loads(body) == dict(json.loads(public[1]), access_token="REDACTED")
+        with pytest.raises(api.CustomError):
+            api.get_operation_status("op")
+
+    assert replayed == recorded
+    assert len(server["hits"]) == hits
+    assert time.perf_counter() - start >= 0.3
+    assert not isinstance(api.requests, api._CassetteRequests)
+
+
+def test_cassette_rejects_invalid_latency(api, tmp_path):
+    with pytest.raises(api.CustomError):
+        api.Cassette(str(tmp_path / "cassette.json.gz"), "replay", -1)